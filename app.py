@@ -1,21 +1,101 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, send_file
 from flask_cors import CORS
-import json
+from flask_compress import Compress
 import os
+import atexit
 import base64
-import requests
+import hashlib
+import threading
+import time
+import orjson
+import httpx
+from concurrent.futures import Future
 from datetime import datetime
 
 app = Flask(__name__)
 CORS(app)
 
+# Gzip JSON responses; the board compresses well thanks to repeated keys
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+# Leave streamed file responses (the backup download) untouched so they keep
+# zero-copy sendfile, their ETag and 304/Range handling
+app.config["COMPRESS_STREAMS"] = False
+Compress(app)
+
+def fast_jsonify(obj):
+    """Build a JSON response with orjson instead of Flask's jsonify"""
+    return app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 # GitHub configuration from environment variables
 GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
 GITHUB_REPO = os.environ.get('GITHUB_REPO')
 DATA_FILE = 'kanban-data.json'
 
+# Environment doesn't change at runtime, so resolve these once
+GITHUB_ENABLED = bool(GITHUB_TOKEN) and bool(GITHUB_REPO)
+GH_HEADERS = {
+    "Authorization": f"token {GITHUB_TOKEN}",
+    "Accept": "application/vnd.github.v3+json"
+}
+
 # Fallback to local file if GitHub not configured
 LOCAL_DB_FILE = 'database.json'
+# Present while the local file holds edits GitHub hasn't accepted yet
+LOCAL_UNSYNCED_FILE = LOCAL_DB_FILE + '.unsynced'
+_local_lock = threading.Lock()
+_local_cache = {"key": None, "data": None}
+
+# Shared HTTP/2 GitHub client: one keep-alive connection multiplexes the
+# refresh, SHA prefetch and save requests instead of queueing them
+GH = httpx.Client(
+    headers=GH_HEADERS,
+    timeout=10.0,
+    # GitHub redirects renamed or transferred repos; requests followed these
+    follow_redirects=True,
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60)
+    )
+)
+
+# The transport only retries connection failures; retry transient 5xx too
+GH_RETRY_STATUSES = (502, 503, 504)
+GH_STATUS_RETRIES = 2
+
+def gh_request(method, url, **kwargs):
+    """Send a GitHub API request, retrying transient 5xx responses"""
+    for attempt in range(GH_STATUS_RETRIES + 1):
+        response = GH.request(method, url, **kwargs)
+        if response.status_code not in GH_RETRY_STATUSES or attempt == GH_STATUS_RETRIES:
+            return response
+        print(f"GitHub {method} returned {response.status_code}, retrying")
+        time.sleep(0.1 * 2 ** attempt)
+
+# Last GitHub ETag and its decoded (data, sha), for conditional GETs
+_gh_etag = None
+_gh_cache = None
+_gh_lock = threading.Lock()
+
+# GitHub GET currently in flight, shared by concurrent get_github_file calls
+_inflight = {"future": None, "lock": threading.Lock()}
+
+# Hash and SHA of the last payload written to GitHub, to skip identical writes
+_last_saved_hash = None
+_last_saved_sha = None
+
+# Coalesce bursts of writes: POSTs fill a latest-wins slot that a background
+# thread flushes to GitHub at most once every GITHUB_DEBOUNCE_SECONDS
+DEBOUNCE_S = float(os.environ.get('GITHUB_DEBOUNCE_SECONDS', 5))
+WRITER_RETRY_MIN_S = 1
+WRITER_RETRY_MAX_S = 300
+_pending = {"data": None, "version": 0, "flushing": False, "cond": threading.Condition()}
+
+# In-memory copy of the board served by GET /api/data, refreshed from GitHub
+# every GITHUB_REFRESH_SECONDS with conditional requests
+REFRESH_S = float(os.environ.get('GITHUB_REFRESH_SECONDS', 10))
+SNAPSHOT = None
+_snapshot_lock = threading.Lock()
 
 # Default data structure
 DEFAULT_DATA = {
@@ -29,29 +109,59 @@ DEFAULT_DATA = {
     "dropdownStates": {}
 }
 
-def is_github_configured():
-    """Check if GitHub is properly configured"""
-    return bool(GITHUB_TOKEN and GITHUB_REPO)
+# Serialized once so reset and first-run writes skip re-encoding
+DEFAULT_DATA_JSON = orjson.dumps(DEFAULT_DATA, option=orjson.OPT_INDENT_2)
+DEFAULT_DATA_COMPACT = orjson.dumps(DEFAULT_DATA)
+DEFAULT_DATA_HASH = hashlib.blake2b(DEFAULT_DATA_COMPACT, digest_size=16).digest()
+DEFAULT_DATA_B64 = base64.b64encode(DEFAULT_DATA_COMPACT).decode('ascii')
 
 def get_github_file():
-    """Get file from GitHub"""
-    if not is_github_configured():
+    """Get file from GitHub, sharing one request among concurrent callers"""
+    if not GITHUB_ENABLED:
         return None, None
     
+    with _inflight["lock"]:
+        future = _inflight["future"]
+        owner = future is None
+        if owner:
+            future = _inflight["future"] = Future()
+    
+    if not owner:
+        return future.result()
+    
+    try:
+        future.set_result(fetch_github_file())
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _inflight["lock"]:
+            _inflight["future"] = None
+    return future.result()
+
+def fetch_github_file(conditional=True):
+    """Fetch file from GitHub, using the cached ETag unless told not to"""
     url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{DATA_FILE}"
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    
+    global _gh_etag, _gh_cache
+    
+    with _gh_lock:
+        etag = _gh_etag if conditional else None
+    headers = {"If-None-Match": etag} if etag else None
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = gh_request('GET', url, headers=headers, timeout=10)
         print(f"GitHub GET status: {response.status_code}")
         
-        if response.status_code == 200:
+        if response.status_code == 304:
+            with _gh_lock:
+                return _gh_cache
+        elif response.status_code == 200:
             data = response.json()
-            content = base64.b64decode(data['content']).decode('utf-8')
-            return json.loads(content), data['sha']
+            parsed = orjson.loads(base64.b64decode(data['content']))
+            with _gh_lock:
+                _gh_etag = response.headers.get('ETag')
+                _gh_cache = (parsed, data['sha'])
+            return parsed, data['sha']
         elif response.status_code == 404:
             print("File not found on GitHub, will create new")
             return None, None
@@ -62,20 +172,40 @@ def get_github_file():
         print(f"Error fetching from GitHub: {e}")
         return None, None
 
+def get_cached_sha():
+    """Get the SHA from the last GitHub GET or PUT, without a round-trip"""
+    with _gh_lock:
+        return _gh_cache[1] if _gh_cache else None
+
 def save_to_github(data, sha=None):
-    """Save file to GitHub"""
-    if not is_github_configured():
+    """Save file to GitHub, returning the new SHA or None on failure"""
+    global _gh_etag, _gh_cache, _last_saved_hash, _last_saved_sha
+    
+    if not GITHUB_ENABLED:
         print("GitHub not configured")
-        return False
+        return None
     
     url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{DATA_FILE}"
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-    }
     
-    content = json.dumps(data, indent=2)
-    encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
+    # Stored compact; pretty-printing only inflates the JSON and base64
+    if data is DEFAULT_DATA:
+        content = DEFAULT_DATA_COMPACT
+        content_hash = DEFAULT_DATA_HASH
+    else:
+        content = orjson.dumps(data)
+        content_hash = hashlib.blake2b(content, digest_size=16).digest()
+    
+    # Skip the PUT if this exact payload is what GitHub already holds
+    with _gh_lock:
+        cached_sha = _gh_cache[1] if _gh_cache else None
+        if content_hash == _last_saved_hash and cached_sha == _last_saved_sha:
+            print("Data unchanged since last save, skipping GitHub write")
+            return cached_sha
+    
+    if data is DEFAULT_DATA:
+        encoded_content = DEFAULT_DATA_B64
+    else:
+        encoded_content = base64.b64encode(content).decode('ascii')
     
     payload = {
         "message": f"Update kanban data - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
@@ -87,46 +217,190 @@ def save_to_github(data, sha=None):
         payload["sha"] = sha
     
     try:
-        response = requests.put(url, headers=headers, json=payload, timeout=10)
+        response = gh_request('PUT', url, json=payload, timeout=10)
         print(f"GitHub PUT status: {response.status_code}")
         
+        # Stale or missing SHA: refresh it once and retry
+        if response.status_code in [409, 422]:
+            # Bypass the ETag and any in-flight GET: both may predate the conflict
+            print("GitHub SHA conflict, refetching and retrying")
+            _, fresh_sha = fetch_github_file(conditional=False)
+            if fresh_sha:
+                payload["sha"] = fresh_sha
+            response = gh_request('PUT', url, json=payload, timeout=10)
+            print(f"GitHub PUT retry status: {response.status_code}")
+        
         if response.status_code not in [200, 201]:
             print(f"GitHub save error: {response.text}")
-            return False
-        return True
+            return None
+        
+        new_sha = response.json()['content']['sha']
+        with _gh_lock:
+            # The old ETag describes the pre-PUT file, so drop it with the cache
+            _gh_etag = None
+            _gh_cache = (data, new_sha)
+            _last_saved_hash = content_hash
+            _last_saved_sha = new_sha
+        return new_sha
     except Exception as e:
         print(f"Error saving to GitHub: {e}")
-        return False
+        return None
+
+def stat_key(st):
+    """Identify a version of the local file; os.replace gives each save a new inode"""
+    return st.st_mtime_ns, st.st_ino, st.st_size
 
 def load_from_local():
-    """Load data from local file"""
-    if not os.path.exists(LOCAL_DB_FILE):
+    """Load data from local file, reusing the parsed copy if unchanged"""
+    try:
+        key = stat_key(os.stat(LOCAL_DB_FILE))
+    except FileNotFoundError:
         save_to_local(DEFAULT_DATA)
         return DEFAULT_DATA
     
+    with _local_lock:
+        if key == _local_cache["key"] and _local_cache["data"] is not None:
+            return _local_cache["data"]
+    
     try:
-        with open(LOCAL_DB_FILE, 'r') as f:
-            data = json.load(f)
-            if not data or 'columns' not in data:
-                return DEFAULT_DATA
-            return data
-    except (json.JSONDecodeError, IOError) as e:
+        with open(LOCAL_DB_FILE, 'rb') as f:
+            key = stat_key(os.fstat(f.fileno()))
+            data = orjson.loads(f.read())
+        if not data or 'columns' not in data:
+            data = DEFAULT_DATA
+        with _local_lock:
+            _local_cache["key"] = key
+            _local_cache["data"] = data
+        return data
+    except (orjson.JSONDecodeError, IOError) as e:
         print(f"Error loading local file: {e}")
         return DEFAULT_DATA
 
 def save_to_local(data):
     """Save data to local file"""
     try:
-        with open(LOCAL_DB_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        content = DEFAULT_DATA_JSON if data is DEFAULT_DATA else orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        
+        # Write a sibling temp file and rename it over, so a crash mid-write
+        # never leaves a truncated database behind
+        tmp = LOCAL_DB_FILE + '.tmp'
+        with _local_lock:
+            with open(tmp, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, LOCAL_DB_FILE)
         return True
     except IOError as e:
         print(f"Error saving to local file: {e}")
         return False
 
+def mark_local_unsynced():
+    """Record that the local file is ahead of GitHub"""
+    try:
+        open(LOCAL_UNSYNCED_FILE, 'wb').close()
+    except IOError as e:
+        print(f"Error marking local file unsynced: {e}")
+
+def mark_local_synced():
+    """Record that GitHub holds everything in the local file"""
+    try:
+        os.remove(LOCAL_UNSYNCED_FILE)
+    except FileNotFoundError:
+        pass
+    except IOError as e:
+        print(f"Error marking local file synced: {e}")
+
+def is_local_unsynced():
+    """Check if the local file has edits not yet written to GitHub"""
+    return os.path.exists(LOCAL_UNSYNCED_FILE)
+
+def has_pending_write():
+    """Check if there is data not yet flushed to GitHub"""
+    with _pending["cond"]:
+        return _pending["data"] is not None or _pending["flushing"]
+
+def queue_github_save(data):
+    """Hand data to the background writer; only the latest version is kept"""
+    with _pending["cond"]:
+        _pending["data"] = data
+        _pending["version"] += 1
+        _pending["cond"].notify_all()
+
+def flush_pending_write():
+    """Push queued data to GitHub, putting it back in the slot on failure"""
+    cond = _pending["cond"]
+    with cond:
+        data = _pending["data"]
+        version = _pending["version"]
+        if data is None:
+            return True
+        _pending["data"] = None
+        _pending["flushing"] = True
+    
+    saved = False
+    try:
+        saved = save_to_github(data, get_cached_sha()) is not None
+        if saved:
+            print("Saved to GitHub successfully")
+    except Exception as e:
+        print(f"Error in GitHub writer: {e}")
+    finally:
+        with cond:
+            # Retry later unless a newer version has been queued meanwhile
+            if _pending["version"] == version:
+                if saved:
+                    mark_local_synced()
+                else:
+                    _pending["data"] = data
+            _pending["flushing"] = _pending["data"] is not None
+            cond.notify_all()
+    return saved
+
+def github_writer():
+    """Background loop that flushes queued data to GitHub"""
+    cond = _pending["cond"]
+    retry_delay = max(DEBOUNCE_S, WRITER_RETRY_MIN_S)
+    while True:
+        with cond:
+            cond.wait_for(lambda: _pending["data"] is not None)
+            _pending["flushing"] = True
+        
+        # Let further updates land in the slot before writing, fetching the
+        # SHA meanwhile if no earlier GET or PUT has cached one
+        started = time.monotonic()
+        if get_cached_sha() is None:
+            try:
+                get_github_file()
+            except Exception as e:
+                print(f"Error prefetching SHA: {e}")
+        time.sleep(max(0.0, DEBOUNCE_S - (time.monotonic() - started)))
+        
+        if flush_pending_write():
+            retry_delay = max(DEBOUNCE_S, WRITER_RETRY_MIN_S)
+        else:
+            print(f"GitHub write failed, retrying in {retry_delay:.0f}s")
+            time.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, WRITER_RETRY_MAX_S)
+
+def flush_on_exit():
+    """Write out any queued data before the process exits"""
+    with _pending["cond"]:
+        # Let an in-flight write finish; a failed one goes back in the slot
+        _pending["cond"].wait_for(
+            lambda: _pending["data"] is not None or not _pending["flushing"],
+            timeout=30
+        )
+    flush_pending_write()
+
 def load_data():
     """Load data from GitHub or fallback to local"""
-    if is_github_configured():
+    if GITHUB_ENABLED:
+        # The local file is ahead of GitHub until the writer catches up
+        if has_pending_write():
+            print("Loaded data from local file (GitHub write pending)")
+            return load_from_local(), None, 'local'
+        
         data, sha = get_github_file()
         if data:
             print("Loaded data from GitHub")
@@ -137,35 +411,78 @@ def load_data():
     print("Loaded data from local file")
     return data, None, 'local'
 
-def save_data(data, sha=None):
-    """Save data to GitHub and local backup"""
-    github_success = False
-    local_success = False
-    
-    # Try GitHub first if configured
-    if is_github_configured():
-        github_success = save_to_github(data, sha)
-        if github_success:
-            print("Saved to GitHub successfully")
-    
-    # Always save to local as backup
-    local_success = save_to_local(data)
-    if local_success:
-        print("Saved to local file successfully")
-    
-    return github_success or local_success
+def set_snapshot(data, sha, source):
+    """Atomically replace the in-memory snapshot"""
+    global SNAPSHOT
+    SNAPSHOT = {"data": data, "sha": sha, "source": source}
+
+def adopt_github_data(data, sha):
+    """Use data fetched from GitHub, mirroring it to the local file"""
+    with _pending["cond"]:
+        # A save may have landed while we were fetching, or an earlier one may
+        # never have reached GitHub; local edits win either way
+        if has_pending_write() or is_local_unsynced():
+            return
+        if SNAPSHOT is None or SNAPSHOT["sha"] != sha:
+            save_to_local(data)
+        set_snapshot(data, sha, 'github')
+
+def get_snapshot():
+    """Get the in-memory snapshot, loading it on first use"""
+    if SNAPSHOT is None:
+        with _snapshot_lock:
+            if SNAPSHOT is None:
+                data, sha, source = load_data()
+                if source == 'github':
+                    adopt_github_data(data, sha)
+                else:
+                    with _pending["cond"]:
+                        if SNAPSHOT is None:
+                            set_snapshot(data, sha, source)
+    return SNAPSHOT
+
+def refresh_loop():
+    """Background loop that keeps the snapshot in sync with GitHub"""
+    while True:
+        time.sleep(REFRESH_S)
+        try:
+            if has_pending_write():
+                continue
+            data, sha = get_github_file()
+            if data:
+                adopt_github_data(data, sha)
+        except Exception as e:
+            print(f"Error refreshing snapshot: {e}")
+
+def save_data(data):
+    """Save data to local file and queue it for GitHub"""
+    with _pending["cond"]:
+        # Always save locally first so nothing is lost if the process dies
+        local_success = save_to_local(data)
+        if local_success:
+            print("Saved to local file successfully")
+        
+        # Never accept an edit that only exists in memory
+        if not local_success:
+            return False
+        
+        if GITHUB_ENABLED:
+            mark_local_unsynced()
+            queue_github_save(data)
+        set_snapshot(data, None, 'local')
+        return True
 
 @app.route('/')
 def index():
     """Health check"""
-    storage_type = "GitHub + Local Backup" if is_github_configured() else "Local File Only"
-    github_status = "✓ Connected" if is_github_configured() else "✗ Not configured"
+    storage_type = "GitHub + Local Backup" if GITHUB_ENABLED else "Local File Only"
+    github_status = "✓ Connected" if GITHUB_ENABLED else "✗ Not configured"
     
-    return jsonify({
+    return fast_jsonify({
         "status": "ok",
         "message": "KanBan API is running",
         "storage": storage_type,
-        "github_configured": is_github_configured(),
+        "github_configured": GITHUB_ENABLED,
         "github_status": github_status,
         "github_repo": GITHUB_REPO if GITHUB_REPO else "Not set",
         "github_token": "Set" if GITHUB_TOKEN else "Not set"
@@ -174,98 +491,113 @@ def index():
 @app.route('/api/data', methods=['GET'])
 def get_data():
     """Get all kanban data"""
-    data, sha, source = load_data()
-    response = jsonify(data)
-    response.headers['X-Data-Source'] = source
+    snapshot = get_snapshot()
+    response = fast_jsonify(snapshot["data"])
+    response.headers['X-Data-Source'] = snapshot["source"]
     return response
 
 @app.route('/api/data', methods=['POST'])
 def update_data():
     """Update all kanban data"""
     try:
-        data = request.get_json()
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError as e:
+            # orjson is stricter than the stdlib, e.g. about lone surrogates
+            print(f"Invalid JSON in request: {e}")
+            return fast_jsonify({"error": f"Invalid JSON: {e}"}), 400
         if not data:
             print("No data provided in request")
-            return jsonify({"error": "No data provided"}), 400
+            return fast_jsonify({"error": "No data provided"}), 400
         
         print(f"Received data with {len(data.get('columns', []))} columns")
         
-        # Get latest SHA if using GitHub
-        sha = None
-        if is_github_configured():
-            _, sha = get_github_file()
-            print(f"Current SHA: {sha}")
-        
-        if save_data(data, sha):
-            return jsonify({
+        if save_data(data):
+            if GITHUB_ENABLED:
+                return fast_jsonify({
+                    "success": True,
+                    "message": "Data saved locally, GitHub sync queued",
+                    "storage": "github"
+                }), 202
+            return fast_jsonify({
                 "success": True,
                 "message": "Data saved successfully",
-                "storage": "github" if is_github_configured() else "local"
+                "storage": "local"
             })
         else:
             print("Save failed")
-            return jsonify({"error": "Failed to save data"}), 500
+            return fast_jsonify({"error": "Failed to save data"}), 500
     except Exception as e:
         print(f"Error in update_data: {e}")
-        return jsonify({"error": str(e)}), 500
+        return fast_jsonify({"error": str(e)}), 500
 
 @app.route('/api/reset', methods=['POST'])
 def reset_data():
     """Reset to default data"""
-    sha = None
-    if is_github_configured():
-        _, sha = get_github_file()
-    
-    if save_data(DEFAULT_DATA, sha):
-        return jsonify({"success": True, "message": "Data reset to defaults"})
+    if save_data(DEFAULT_DATA):
+        return fast_jsonify({"success": True, "message": "Data reset to defaults"})
     else:
-        return jsonify({"error": "Failed to reset data"}), 500
+        return fast_jsonify({"error": "Failed to reset data"}), 500
 
 @app.route('/api/backup', methods=['GET'])
 def backup_data():
     """Get backup of all data as JSON download"""
-    data, _, _ = load_data()
-    return jsonify(data), 200, {
-        'Content-Disposition': 'attachment; filename=kanban_backup.json'
-    }
+    # The local file always mirrors the snapshot, so stream it as-is
+    get_snapshot()
+    return send_file(
+        os.path.abspath(LOCAL_DB_FILE),
+        mimetype="application/json",
+        as_attachment=True,
+        download_name="kanban_backup.json",
+        conditional=True
+    )
 
 @app.route('/api/test-github', methods=['GET'])
 def test_github():
     """Test GitHub connection"""
-    if not is_github_configured():
-        return jsonify({
+    if not GITHUB_ENABLED:
+        return fast_jsonify({
             "configured": False,
             "error": "GITHUB_TOKEN or GITHUB_REPO not set"
         })
     
     try:
         url = f"https://api.github.com/repos/{GITHUB_REPO}"
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        response = requests.get(url, headers=headers, timeout=10)
+        response = gh_request('GET', url, timeout=10)
         
         if response.status_code == 200:
-            return jsonify({
+            return fast_jsonify({
                 "configured": True,
                 "connected": True,
                 "repo": GITHUB_REPO,
                 "message": "GitHub connection successful"
             })
         else:
-            return jsonify({
+            return fast_jsonify({
                 "configured": True,
                 "connected": False,
                 "error": f"Status {response.status_code}: {response.text}"
             })
     except Exception as e:
-        return jsonify({
+        return fast_jsonify({
             "configured": True,
             "connected": False,
             "error": str(e)
         })
 
+if GITHUB_ENABLED:
+    # Edits saved locally before a crash or failed write go out first
+    if is_local_unsynced():
+        print("Local file has unsynced changes, queueing them for GitHub")
+        queue_github_save(load_from_local())
+    threading.Thread(target=github_writer, daemon=True).start()
+    atexit.register(flush_on_exit)
+    threading.Thread(target=refresh_loop, daemon=True).start()
+
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # The Werkzeug server is for local development only (DEV=1)
+    if os.environ.get('DEV'):
+        port = int(os.environ.get('PORT', 5000))
+        app.run(host='0.0.0.0', port=port, debug=False)
+    else:
+        os.execvp('gunicorn', ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'])
@@ -0,0 +1,16 @@
+import os
+
+# Threaded workers so requests are served concurrently. Keep a single worker:
+# the snapshot and the GitHub writer live in-process, and several workers
+# would each hold their own copy and race each other's writes.
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = "gthread"
+workers = 1
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+timeout = 30
+
+
+def worker_exit(server, worker):
+    # Push edits still waiting in the debounce slot before the worker dies
+    from app import flush_on_exit
+    flush_on_exit()